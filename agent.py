@@ -2,21 +2,45 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
-from typing import Any, Dict, List, Tuple, Optional
+import hashlib
+import pathlib
+import sys
+import time
+from typing import Any, Dict, Final, List, Tuple, Optional
 
-from anthropic import Anthropic
+#orjson更快，没装时退回标准库json
+try:
+    import orjson
 
-from firestore_tools import create_contact, create_task, create_call_note
+    def _json_loads(raw: str) -> Any:
+        return orjson.loads(raw)
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+except ImportError:
+    def _json_loads(raw: str) -> Any:
+        return json.loads(raw)
+
+    def _json_dumps(obj: Any, indent: bool = False) -> str:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+import httpx
+from anthropic import Anthropic, DefaultHttpxClient
+
+from validation import validate_output
+
+from firestore_tools import batch_writer, create_contact, create_task, create_call_note
 
 from mic_record import record_wav
 from stt_gcp import transcribe_wav
 
 
 #prompt for claude
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT: Final[str] = """
 You are an AI assistant for a real-estate sales team.
 
-You will be given a sales call transcript (already transcribed to text).
+You will be given a sales call transcript (already transcribed to text) inside <transcript> tags.
+The tags are not part of the transcript; never include them in any output field.
 Your responsibilities are to:
 1) Extract structured CRM facts (contact + call_note) from the transcript.
 2) Propose the next 1–3 operational actions for a real-estate agent.
@@ -50,9 +74,9 @@ FACT EXTRACTION RULES:
 - contact.timeline should be concise natural language, e.g., "within the next 2 months", "next week".
 
 CALL NOTE RULES:
-- call_note.rawTranscript MUST contain the full transcript text exactly as provided (verbatim).
+- call_note.rawTranscript MUST always be null. Do NOT copy the transcript into the output; the software attaches it.
 - call_note.summary must be 1–3 concise sentences capturing intent/location/budget/timeline/next step.
-- If no meaningful call note can be produced, set call_note.summary and call_note.rawTranscript to null and omit create_call_note.
+- If no meaningful call note can be produced, set call_note.summary to null and omit create_call_note.
 
 ACTIONS RULES:
 - Return between 1 and 3 actions.
@@ -79,7 +103,7 @@ JSON SCHEMA (MUST MATCH EXACTLY):
   },
   "call_note": {
     "summary": string or null,
-    "rawTranscript": string or null
+    "rawTranscript": null
   },
   "actions": [
     { "type": "create_contact", "payload": {} },
@@ -92,7 +116,7 @@ Now produce the JSON object.
 """
 
 #防御机制的prompt
-REPAIR_SYSTEM_PROMPT = """
+REPAIR_SYSTEM_PROMPT: Final[str] = """
 You are a strict JSON repair assistant.
 
 You will be given:
@@ -107,153 +131,85 @@ Your task:
 - Do NOT add new keys outside the schema.
 - Enforce: create_contact.payload == {} and create_call_note.payload == {}.
 - Keep all facts in top-level 'contact' and 'call_note'.
+- Set call_note.rawTranscript to null; never copy the transcript into the output.
 """
 
-client = Anthropic()
+#两个system prompt是prompt cache的前缀，必须逐字节不变（不要f-string拼接动态内容）
+#启动时打印fingerprint，session中途改了prompt就能看出来
+PROMPT_FINGERPRINT: Final[str] = hashlib.sha256(
+    (SYSTEM_PROMPT + REPAIR_SYSTEM_PROMPT).encode("utf-8")
+).hexdigest()[:12]
+
+#HTTP/2需要h2（httpx[http2]），没装时退回HTTP/1.1，keepalive照样生效
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+#HTTP/2 + keepalive，repair重试时复用同一个连接，不用重新TCP/TLS握手
+client = Anthropic(
+    http_client=DefaultHttpxClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+)
+
+MODEL = "claude-sonnet-4-5-20250929"
+
+#输出JSON一般300-500 tokens（rawTranscript不回显，由本地注入）
+MAX_OUTPUT_TOKENS = 600
+#JSON输出里不会出现连续空行，出现说明JSON已经结束
+STOP_SEQUENCES = ["\n\n\n"]
+
+#把静态system prompt包成可缓存的block，第二次起从prompt cache读取
+#前缀不足模型最低可缓存长度（Sonnet为1024 tokens）时API会直接忽略cache_control
+def _cached_system(prompt: str) -> List[Dict[str, Any]]:
+    return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
 
-ALLOWED_ACTION_TYPES = {"create_contact", "create_task", "create_call_note"}
-ALLOWED_TASK_TYPES = {"follow_up", "schedule_tour", "send_listings"}
+#打印prompt cache命中情况
+def _log_cache_usage(usage: Any) -> None:
+    read = getattr(usage, "cache_read_input_tokens", None) or 0
+    created = getattr(usage, "cache_creation_input_tokens", None) or 0
+    print(f"ℹ️ Prompt cache: read={read} created={created} uncached={usage.input_tokens}")
+    if not read and not created:
+        print("⚠️ Prompt cache inactive (prefix likely below the minimum cacheable length).")
 
 #接受用户的input，因为text里有空行，所以两次enter为结束
 def read_multiline_input() -> str:
     print("\nPaste call transcript (press Enter twice to finish):\n")
     lines: List[str] = []
-    empty_count = 0
     while True:
-        line = input()
-        if line.strip() == "":
-            empty_count += 1
-            if empty_count >= 2:
-                break
-            continue
-        empty_count = 0
+        line = sys.stdin.readline()
+        #EOF
+        if not line:
+            break
         lines.append(line)
-    return "\n".join(lines)
+        #连续两个空行
+        if len(lines) >= 2 and not lines[-1].strip() and not lines[-2].strip():
+            break
+    return "".join(lines).strip()
+
+#从第一个"{"开始解析一个完整object，返回结束位置，后面的```等内容直接忽略
+_RAW_DECODER = json.JSONDecoder()
 
 #parse claude返回的json string，处理markdown形式
 def parse_json_robust(text: str) -> Tuple[Dict[str, Any], str]:
     raw = text.strip()
 
-    if raw.startswith("```"):
-        lines = raw.splitlines()
-        if len(lines) >= 2 and lines[0].startswith("```"):
-            lines = lines[1:]
-        if len(lines) >= 1 and lines[-1].strip() == "```":
-            lines = lines[:-1]
-        raw = "\n".join(lines).strip()
+    #正常情况：整段就是JSON，直接parse
+    if raw.startswith("{"):
+        try:
+            return _json_loads(raw), raw
+        except ValueError:
+            pass
 
+    #有markdown或前后多余文字：从第一个"{"扫描出第一个完整object
     start = raw.find("{")
-    end = raw.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        raw = raw[start:end + 1].strip()
-
-    parsed = json.loads(raw)
-    return parsed, raw
-
-#检查是否数字
-def _is_number(x: Any) -> bool:
-    return isinstance(x, (int, float)) and not isinstance(x, bool)
-
-#validation机制，详细检查output是否符合system prompt的要求
-def validate_output(data: Dict[str, Any]) -> Tuple[bool, List[str]]:
-    errors: List[str] = []
-
-    #output是否是json
-    if not isinstance(data, dict):
-        return False, ["Output is not a JSON object."]
-
-    #Top-level的keys是否齐全
-    for key in ["contact", "call_note", "actions"]:
-        if key not in data:
-            errors.append(f"Missing top-level key: '{key}'")
-
-    contact = data.get("contact")
-    call_note = data.get("call_note")
-    actions = data.get("actions")
-
-    #contact schema
-    #是否是json
-    if not isinstance(contact, dict):
-        errors.append("Top-level 'contact' must be an object.")
-    else:
-        #哪怕是null也要包含所有字段
-        required_contact_keys = ["name", "email", "phone", "need", "budget", "timeline"]
-        for k in required_contact_keys:
-            if k not in contact:
-                errors.append(f"contact missing key: '{k}'")
-        #budget必须转化为number type或者null
-        b = contact.get("budget")
-        if b is not None and not _is_number(b):
-            errors.append("contact.budget must be a number or null (no $, commas, or abbreviations like '1.2M').")
-
-    #call_note schema
-    #必须是json
-    if not isinstance(call_note, dict):
-        errors.append("Top-level 'call_note' must be an object.")
-    else:
-        #必须有summary和rawTranscript
-        required_note_keys = ["summary", "rawTranscript"]
-        for k in required_note_keys:
-            if k not in call_note:
-                errors.append(f"call_note missing key: '{k}'")
-        #两者必须是string形式
-        s = call_note.get("summary")
-        rt = call_note.get("rawTranscript")
-        if s is not None and not isinstance(s, str):
-            errors.append("call_note.summary must be string or null.")
-        if rt is not None and not isinstance(rt, str):
-            errors.append("call_note.rawTranscript must be string or null.")
-
-    #actions schema
-    #actions必须为非空数组
-    if not isinstance(actions, list) or len(actions) == 0:
-        errors.append("'actions' must be a non-empty array.")
-    else:
-        #数量是1-3
-        if len(actions) > 3:
-            errors.append("actions must contain 1 to 3 items.")
-        #对于每个action
-        for i, act in enumerate(actions):
-            #必须是json
-            if not isinstance(act, dict):
-                errors.append(f"actions[{i}] must be an object.")
-                continue
-            
-            t = act.get("type")
-            payload = act.get("payload")
-            # type必须是在规定范围内的
-            if t not in ALLOWED_ACTION_TYPES:
-                errors.append(f"actions[{i}].type must be one of {sorted(ALLOWED_ACTION_TYPES)}")
-            #每条payload即使{}都不能是None或者非json形式
-            if payload is None or not isinstance(payload, dict):
-                errors.append(f"actions[{i}].payload must be an object ({{}} allowed).")
-                continue
-            #如果有create contact，那么payload必须为空，因为其信息储存在了top level里
-            if t == "create_contact":
-                if payload != {}:
-                    errors.append("create_contact.payload MUST be {} (facts must live in top-level contact).")
-            #如果有create call note，那么payload必须为空，因为其信息储存在了top level里
-            elif t == "create_call_note":
-                if payload != {}:
-                    errors.append("create_call_note.payload MUST be {} (facts must live in top-level call_note).")
-            #如果有create task，那么payload必须包含task type, description, due，类型也都必须是string
-            elif t == "create_task":
-                allowed_keys = {"task_type", "description", "due"}
-                keys = set(payload.keys())
-                if keys != allowed_keys:
-                    errors.append(
-                        f"create_task.payload must have exactly keys {sorted(list(allowed_keys))}, got {sorted(list(keys))}"
-                    )
-                else:
-                    if payload["task_type"] not in ALLOWED_TASK_TYPES:
-                        errors.append(f"create_task.payload.task_type must be one of {sorted(ALLOWED_TASK_TYPES)}")
-                    if not isinstance(payload["description"], str) or not payload["description"].strip():
-                        errors.append("create_task.payload.description must be a non-empty string.")
-                    if payload["due"] is not None and not isinstance(payload["due"], str):
-                        errors.append("create_task.payload.due must be string or null.")
-
-    #返回error list，里面包含所有需要修改的部分
-    return (len(errors) == 0), errors
+    if start == -1:
+        return _json_loads(raw), raw
+    parsed, end = _RAW_DECODER.raw_decode(raw, start)
+    return parsed, raw[start:end]
 
 #让claude repair，二次编译
 def repair_with_claude(transcript: str, bad_json_text: str, errors: List[str]) -> Tuple[Dict[str, Any], str]:
@@ -272,31 +228,79 @@ def repair_with_claude(transcript: str, bad_json_text: str, errors: List[str]) -
         },
     }
 
-    resp = client.messages.create(
-        model="claude-sonnet-4-5-20250929",
-        max_tokens=900,
-        # temperature=0,
+    #stream边生成边接收，不用等整段response
+    with client.messages.stream(
+        model=MODEL,
+        max_tokens=MAX_OUTPUT_TOKENS,
+        temperature=0,
+        stop_sequences=STOP_SEQUENCES,
+        #REPAIR_SYSTEM_PROMPT只有约150 tokens，远低于最低可缓存长度，不加cache_control
         system=REPAIR_SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": json.dumps(prompt)}],
-    )
+        messages=[{"role": "user", "content": _json_dumps(prompt)}],
+    ) as stream:
+        text = "".join(stream.text_stream)
 
-    parsed, extracted = parse_json_robust(resp.content[0].text)
+    parsed, extracted = parse_json_robust(text)
     return parsed, extracted
 
-#第一次call claude
+#第一次call claude，transcript放在user message（动态内容在最后）
 def call_claude_once(transcript: str) -> Tuple[Dict[str, Any], str]:
-    resp = client.messages.create(
-        model="claude-sonnet-4-5-20250929",
-        max_tokens=900,
-        # temperature=0
-        system=SYSTEM_PROMPT,
-        messages=[{"role": "user", "content": transcript}],
-    )
-    parsed, extracted = parse_json_robust(resp.content[0].text)
+    with client.messages.stream(
+        model=MODEL,
+        max_tokens=MAX_OUTPUT_TOKENS,
+        temperature=0,
+        stop_sequences=STOP_SEQUENCES,
+        system=_cached_system(SYSTEM_PROMPT),
+        messages=[{"role": "user", "content": f"<transcript>\n{transcript}\n</transcript>"}],
+    ) as stream:
+        text = "".join(stream.text_stream)
+        _log_cache_usage(stream.get_final_message().usage)
+    parsed, extracted = parse_json_robust(text)
     return parsed, extracted
 
-#call claude，包括纠错
+#本地response cache：同样的model+prompt+transcript直接返回上次validated的结果
+RESPONSE_CACHE_DIR = pathlib.Path(".agent_cache")
+RESPONSE_CACHE_TTL_S = 24 * 3600
+
+def _response_cache_path(transcript: str) -> pathlib.Path:
+    key = hashlib.sha256(
+        "\0".join((MODEL, SYSTEM_PROMPT, REPAIR_SYSTEM_PROMPT, transcript)).encode("utf-8")
+    ).hexdigest()
+    return RESPONSE_CACHE_DIR / f"{key}.json"
+
+def _response_cache_get(path: pathlib.Path) -> Optional[Dict[str, Any]]:
+    try:
+        if time.time() - path.stat().st_mtime > RESPONSE_CACHE_TTL_S:
+            return None
+        data = _json_loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    #文件损坏或按旧规则写入的结果当作miss
+    ok, _ = validate_output(data)
+    return data if ok else None
+
+def _response_cache_put(path: pathlib.Path, data: Dict[str, Any]) -> None:
+    try:
+        RESPONSE_CACHE_DIR.mkdir(exist_ok=True)
+        path.write_text(_json_dumps(data), encoding="utf-8")
+    except OSError as e:
+        print("⚠️ Could not write response cache:", e)
+
+#call claude，包括纠错；命中cache时不调用claude
 def call_claude_with_retry(transcript: str, max_attempts: int = 3) -> Dict[str, Any]:
+    cache_path = _response_cache_path(transcript)
+    data = _response_cache_get(cache_path)
+    if data is not None:
+        print("ℹ️ Using cached response.")
+    else:
+        data = _call_claude_validated(transcript, max_attempts)
+        _response_cache_put(cache_path, data)
+
+    #模型不回显transcript，这里把原文放回call_note
+    data["call_note"]["rawTranscript"] = transcript
+    return data
+
+def _call_claude_validated(transcript: str, max_attempts: int) -> Dict[str, Any]:
     #初尝试
     data, extracted = call_claude_once(transcript)
     #validate
@@ -336,11 +340,18 @@ def _is_contact_meaningful(contact: Optional[Dict[str, Any]]) -> bool:
 def execute_actions(data: Dict[str, Any], transcript: str):
     actions = data.get("actions", [])
     top_contact = data.get("contact", {})
-    top_note = data.get("call_note", {})
+    top_note = data.get("call_note") or {}
 
     if not isinstance(actions, list) or len(actions) == 0:
         raise ValueError("Missing or invalid 'actions' list.")
 
+    #call_claude_with_retry已经注入了原文；不经过它直接传入的data在这里补上
+    if top_note.get("rawTranscript") is None:
+        top_note["rawTranscript"] = transcript
+
+    #所有写入放进一个batch，最后一次commit
+    batch = batch_writer()
+
     # Phase 1: create contact if requested AND meaningful
     contact_id: Optional[str] = None
     for action in actions:
@@ -350,8 +361,8 @@ def execute_actions(data: Dict[str, Any], transcript: str):
             continue
 
         if _is_contact_meaningful(top_contact):
-            contact_id = create_contact(top_contact)
-            print("✅ Created contact:", contact_id)
+            #doc ID在本地生成，tasks和call_note可以直接链接
+            contact_id = create_contact(top_contact, batch=batch)
         else:
             print("ℹ️ Skipped contact creation (insufficient contact info).")
         # only one contact creation
@@ -374,22 +385,24 @@ def execute_actions(data: Dict[str, Any], transcript: str):
         
         if t == "create_task":
             #链接contact id
-            task_id = create_task(payload, contact_id=contact_id)
-            task_ids.append(task_id)
-            print("✅ Created task (linked)" if contact_id else "✅ Created task (unlinked)", ":", task_id)
+            task_ids.append(create_task(payload, contact_id=contact_id, batch=batch))
 
         elif t == "create_call_note":
-            # If call_note is null and action exists, still allow storing transcript fallback if desired
-            note_obj = dict(top_note) if isinstance(top_note, dict) else {}
-            # Ensure transcript present when action requests note creation
-            if note_obj.get("rawTranscript") is None:
-                note_obj["rawTranscript"] = transcript
-            call_note_id = create_call_note(note_obj, contact_id=contact_id)
-            print("✅ Created call_note (linked)" if contact_id else "✅ Created call_note (unlinked)", ":", call_note_id)
+            call_note_id = create_call_note(top_note, contact_id=contact_id, batch=batch)
 
         else:
             print("⚠️ Unknown action type:", t)
 
+    batch.commit()
+
+    #commit成功后再打印
+    if contact_id:
+        print("✅ Created contact:", contact_id)
+    for task_id in task_ids:
+        print("✅ Created task (linked)" if contact_id else "✅ Created task (unlinked)", ":", task_id)
+    if call_note_id:
+        print("✅ Created call_note (linked)" if contact_id else "✅ Created call_note (unlinked)", ":", call_note_id)
+
     return contact_id, task_ids, call_note_id
 
 #用户input选择方式
@@ -408,6 +421,7 @@ def normalize_mode(s: str) -> str:
 
 if __name__ == "__main__":
     print("\n=== AI CRM Automation Demo ===")
+    print(f"ℹ️ System prompt fingerprint: {PROMPT_FINGERPRINT}")
 
     while True:
         raw = input("\nChoose input mode: [1/text] [2/mic] [q/quit] : ")
@@ -446,7 +460,7 @@ if __name__ == "__main__":
         data = call_claude_with_retry(transcript, max_attempts=3)
 
         print("\n--- FINAL JSON (validated) ---")
-        #print(json.dumps(data, indent=2))
+        #print(_json_dumps(data, indent=True))
 
         print("\n--- EXECUTION ---")
         execute_actions(data, transcript)
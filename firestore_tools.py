@@ -6,11 +6,25 @@ PROJECT_ID = "project-1f6eb2e4-ff89-4067-874"
 
 db = firestore.Client(project=PROJECT_ID)
 
-def _now():
-    return datetime.now(timezone.utc)
+#collection reference只建一次，各create_*直接复用
+CONTACTS_COL = db.collection("contacts")
+TASKS_COL = db.collection("tasks")
+NOTES_COL = db.collection("call_notes")
+
+#多个写入放进同一个batch，一次commit完成（一个RTT，且原子）
+def batch_writer() -> firestore.WriteBatch:
+    return db.batch()
+
+#有batch就加入batch（doc ID本地预先生成，commit前就能用），否则直接写入
+def _write(doc_ref: firestore.DocumentReference, payload: Dict[str, Any], batch: Optional[firestore.WriteBatch]) -> str:
+    if batch is not None:
+        batch.set(doc_ref, payload)
+    else:
+        doc_ref.set(payload)
+    return doc_ref.id
 
 #生成contact doc返回doc ID
-def create_contact(contact: Dict[str, Any]) -> str:
+def create_contact(contact: Dict[str, Any], batch: Optional[firestore.WriteBatch] = None) -> str:
     payload = {
         "name": contact.get("name"),
         "email": contact.get("email"),
@@ -18,40 +32,42 @@ def create_contact(contact: Dict[str, Any]) -> str:
         "need": contact.get("need"),
         "budget": contact.get("budget"),
         "timeline": contact.get("timeline"),
-        "createdAt": _now(),
+        "createdAt": datetime.now(timezone.utc),
     }
-    doc_ref = db.collection("contacts").document()
-    doc_ref.set(payload)
-    return doc_ref.id
+    return _write(CONTACTS_COL.document(), payload, batch)
 
 #生成task doc返回doc ID
-def create_task(task_payload: Dict[str, Any], contact_id: Optional[str] = None) -> str:
+def create_task(
+    task_payload: Dict[str, Any],
+    contact_id: Optional[str] = None,
+    batch: Optional[firestore.WriteBatch] = None,
+) -> str:
     payload = {
         "type": task_payload.get("task_type"),
         "description": task_payload.get("description"),
         "due": task_payload.get("due"),
         "status": task_payload.get("status", "open"),
-        "createdAt": _now(),
+        "createdAt": datetime.now(timezone.utc),
     }
     if contact_id:
         payload["contactId"] = contact_id
 
-    doc_ref = db.collection("tasks").document()
-    doc_ref.set(payload)
-    return doc_ref.id
+    return _write(TASKS_COL.document(), payload, batch)
 
 #生成call note doc返回doc ID
-def create_call_note(call_note: Dict[str, Any], contact_id: Optional[str] = None) -> str:
+def create_call_note(
+    call_note: Dict[str, Any],
+    contact_id: Optional[str] = None,
+    batch: Optional[firestore.WriteBatch] = None,
+) -> str:
     """Create a call_note doc and return its document ID. contact_id is optional."""
     payload = {
         "summary": call_note.get("summary"),
         "rawTranscript": call_note.get("rawTranscript"),
-        "createdAt": _now(),
+        "createdAt": datetime.now(timezone.utc),
     }
     if contact_id:
         payload["contactId"] = contact_id
 
-    doc_ref = db.collection("call_notes").document()
-    doc_ref.set(payload)
-    return doc_ref.id
+    return _write(NOTES_COL.document(), payload, batch)
 
@@ -1,7 +1,10 @@
+import os
+import queue
+
 #本地音频I/O库
 import sounddevice as sd
-#把音频转写为wav形式
-from scipy.io.wavfile import write
+#边录边写wav，不用先把整段音频放在内存里
+import soundfile as sf
 
 def record_wav(
     out_path="recording.wav",
@@ -10,14 +13,30 @@ def record_wav(
     channels=1
 ):
     print(f"🎙️ Recording... ({seconds}s). Speak now.")
-    audio = sd.rec(
-        int(seconds * sample_rate),
-        samplerate=sample_rate,
-        channels=channels,
-        dtype="int16"
-    )
-    sd.wait()
-    write(out_path, sample_rate, audio)
+    blocks = queue.Queue()
+
+    #callback在音频线程里，只把block放进queue，写文件放在主线程
+    def _callback(indata, frames, time_info, status):
+        blocks.put(indata.copy())
+
+    #先写临时文件，录完再替换，录音失败时不会把原来的out_path清空
+    tmp_path = out_path + ".part"
+    remaining = int(seconds * sample_rate)
+    try:
+        with sd.InputStream(samplerate=sample_rate, channels=channels, dtype="int16", callback=_callback), \
+                sf.SoundFile(tmp_path, mode="w", samplerate=sample_rate, channels=channels,
+                             format="WAV", subtype="PCM_16") as f:
+            while remaining > 0:
+                try:
+                    block = blocks.get(timeout=seconds + 5)[:remaining]
+                except queue.Empty:
+                    raise RuntimeError("No audio received from the input device.") from None
+                f.write(block)
+                remaining -= len(block)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
     print(f"✅ Saved: {out_path}")
     return out_path
-
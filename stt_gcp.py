@@ -1,19 +1,25 @@
+import wave
+from typing import Optional
+
 from google.cloud import speech_v1 as speech
 
+#SpeechClient建gRPC channel和auth比较慢，整个进程共用一个
+_CLIENT: Optional[speech.SpeechClient] = None
+
+def _client() -> speech.SpeechClient:
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = speech.SpeechClient()
+    return _CLIENT
+
 def transcribe_wav(
     wav_path: str,
     language_code: str = "en-US",
-    sample_rate_hz: int = 1600
+    sample_rate_hz: int = 16000
 ) -> str:
-    
-    client = speech.SpeechClient()
 
-    #读取本地wav
-    with open(wav_path, "rb") as f:
-        content = f.read()
+    client = _client()
 
-    #音频数据在content里
-    audio = speech.RecognitionAudio(content=content)
     #识别
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
@@ -21,14 +27,25 @@ def transcribe_wav(
         language_code=language_code,
         enable_automatic_punctuation=True,
     )
+    streaming_config = speech.StreamingRecognitionConfig(config=config, interim_results=False)
 
-    #把音频同步发到Google，等待返回识别结果
-    response = client.recognize(config=config, audio=audio)
+    #按100ms一块读取本地wav的PCM数据，边读边发
+    def _requests():
+        with wave.open(wav_path, "rb") as wf:
+            frames_per_chunk = max(wf.getframerate() // 10, 1)
+            while True:
+                chunk = wf.readframes(frames_per_chunk)
+                if not chunk:
+                    break
+                yield speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    #streaming发到Google，识别结果随上传陆续返回
+    responses = client.streaming_recognize(config=streaming_config, requests=_requests())
 
     parts = []
-    for result in response.results:
-        if result.alternatives:
-            parts.append(result.alternatives[0].transcript)
+    for response in responses:
+        for result in response.results:
+            if result.is_final and result.alternatives:
+                parts.append(result.alternatives[0].transcript)
 
     return " ".join(parts).strip()
-
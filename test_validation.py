@@ -0,0 +1,83 @@
+import copy
+import unittest
+
+import validation
+
+
+def _good():
+    return {
+        "contact": {
+            "name": "Kevin Rodriguez",
+            "email": "kevin.rodriguez@gmail.com",
+            "phone": "949-777-2345",
+            "need": "Buy a single-family home in Costa Mesa",
+            "budget": 1300000,
+            "timeline": "within two months",
+        },
+        "call_note": {"summary": "Wants listings and a tour next week.", "rawTranscript": None},
+        "actions": [
+            {"type": "create_contact", "payload": {}},
+            {"type": "create_task", "payload": {"task_type": "send_listings", "description": "Send listings", "due": None}},
+            {"type": "create_call_note", "payload": {}},
+        ],
+    }
+
+
+def _with(mutate):
+    data = _good()
+    mutate(data)
+    return data
+
+
+#(名称, data, 是否应通过)
+CASES = [
+    ("good", _good(), True),
+    ("float budget", _with(lambda d: d["contact"].update(budget=1.5e6)), True),
+    ("null budget and due string", _with(lambda d: (d["contact"].update(budget=None), d["actions"][1]["payload"].update(due="next week"))), True),
+    ("single action", _with(lambda d: d.update(actions=[{"type": "create_call_note", "payload": {}}])), True),
+    ("extra key on action", _with(lambda d: d["actions"][0].update(note="x")), True),
+    ("extra top-level key", _with(lambda d: d.update(extra=1)), True),
+    ("not an object", [_good()], False),
+    ("missing actions", _with(lambda d: d.pop("actions")), False),
+    ("missing contact key", _with(lambda d: d["contact"].pop("email")), False),
+    ("string budget", _with(lambda d: d["contact"].update(budget="1.2M")), False),
+    ("bool budget", _with(lambda d: d["contact"].update(budget=True)), False),
+    ("non-string contact name", _with(lambda d: d["contact"].update(name=3)), False),
+    ("non-string summary", _with(lambda d: d["call_note"].update(summary=["x"])), False),
+    ("empty actions", _with(lambda d: d.update(actions=[])), False),
+    ("four actions", _with(lambda d: d["actions"].append({"type": "create_call_note", "payload": {}})), False),
+    ("unknown action type", _with(lambda d: d["actions"][0].update(type="delete_contact")), False),
+    ("non-empty contact payload", _with(lambda d: d["actions"][0].update(payload={"name": "x"})), False),
+    ("null payload", _with(lambda d: d["actions"][2].update(payload=None)), False),
+    ("extra task payload key", _with(lambda d: d["actions"][1]["payload"].update(status="open")), False),
+    ("missing task payload key", _with(lambda d: d["actions"][1]["payload"].pop("due")), False),
+    ("unknown task type", _with(lambda d: d["actions"][1]["payload"].update(task_type="call_back")), False),
+    ("non-string task type", _with(lambda d: d["actions"][1]["payload"].update(task_type=["follow_up"])), False),
+    ("blank description", _with(lambda d: d["actions"][1]["payload"].update(description="  ")), False),
+    ("non-string due", _with(lambda d: d["actions"][1]["payload"].update(due=3)), False),
+]
+
+
+class ValidateOutputTest(unittest.TestCase):
+    def test_validate_output(self):
+        for name, data, expected in CASES:
+            with self.subTest(name):
+                ok, errors = validation.validate_output(copy.deepcopy(data))
+                self.assertEqual(ok, expected, errors)
+                self.assertEqual(ok, not errors)
+
+    #OUTPUT_SCHEMA和_check_fields是同一份contract的两种写法，不能各自漂移
+    @unittest.skipIf(validation._VALIDATE is None, "fastjsonschema not installed")
+    def test_schema_and_field_checks_agree(self):
+        for name, data, _ in CASES:
+            with self.subTest(name):
+                try:
+                    validation._VALIDATE(copy.deepcopy(data))
+                    schema_ok = True
+                except validation.fastjsonschema.JsonSchemaException:
+                    schema_ok = False
+                self.assertEqual(schema_ok, not validation._check_fields(copy.deepcopy(data)))
+
+
+if __name__ == "__main__":
+    unittest.main()
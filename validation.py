@@ -0,0 +1,200 @@
+from typing import Any, Dict, Final, List, Optional, Tuple
+
+#fastjsonschema把schema编译成专用的校验函数，没装时只用手写校验
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+ALLOWED_ACTION_TYPES = frozenset({"create_contact", "create_task", "create_call_note"})
+ALLOWED_TASK_TYPES = frozenset({"follow_up", "schedule_tour", "send_listings"})
+#error message里用的排序字符串，只算一次
+_ALLOWED_ACTION_STR = repr(sorted(ALLOWED_ACTION_TYPES))
+_ALLOWED_TASK_STR = repr(sorted(ALLOWED_TASK_TYPES))
+_TASK_PAYLOAD_KEYS_STR = repr(sorted({"task_type", "description", "due"}))
+_CONTACT_STR_KEYS = ("name", "email", "phone", "need", "timeline")
+#用type()而不是isinstance，顺便排除bool
+_NUM_TYPES = (int, float)
+
+#与SYSTEM_PROMPT里的JSON SCHEMA和_check_fields的规则一致
+_STR_OR_NULL = {"type": ["string", "null"]}
+_EMPTY_PAYLOAD = {"type": "object", "maxProperties": 0}
+OUTPUT_SCHEMA: Final[Dict[str, Any]] = {
+    "type": "object",
+    "required": ["contact", "call_note", "actions"],
+    "properties": {
+        "contact": {
+            "type": "object",
+            "required": ["name", "email", "phone", "need", "budget", "timeline"],
+            "properties": {
+                "name": _STR_OR_NULL,
+                "email": _STR_OR_NULL,
+                "phone": _STR_OR_NULL,
+                "need": _STR_OR_NULL,
+                "budget": {"type": ["number", "null"]},
+                "timeline": _STR_OR_NULL,
+            },
+        },
+        "call_note": {
+            "type": "object",
+            "required": ["summary", "rawTranscript"],
+            "properties": {"summary": _STR_OR_NULL, "rawTranscript": _STR_OR_NULL},
+        },
+        "actions": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 3,
+            "items": {
+                "type": "object",
+                "required": ["type", "payload"],
+                "oneOf": [
+                    {"properties": {"type": {"const": "create_contact"}, "payload": _EMPTY_PAYLOAD}},
+                    {"properties": {"type": {"const": "create_call_note"}, "payload": _EMPTY_PAYLOAD}},
+                    {
+                        "properties": {
+                            "type": {"const": "create_task"},
+                            "payload": {
+                                "type": "object",
+                                "required": ["task_type", "description", "due"],
+                                "additionalProperties": False,
+                                "properties": {
+                                    "task_type": {"enum": sorted(ALLOWED_TASK_TYPES)},
+                                    "description": {"type": "string", "pattern": "\\S"},
+                                    "due": _STR_OR_NULL,
+                                },
+                            },
+                        }
+                    },
+                ],
+            },
+        },
+    },
+}
+
+_VALIDATE = fastjsonschema.compile(OUTPUT_SCHEMA) if fastjsonschema is not None else None
+
+#validation机制，详细检查output是否符合system prompt的要求
+def validate_output(data: Dict[str, Any]) -> Tuple[bool, List[str]]:
+    #fast path：编译好的schema通过就直接返回
+    #不通过时继续走逐项检查，收集全部error给repair用
+    schema_error: Optional[str] = None
+    if _VALIDATE is not None:
+        try:
+            _VALIDATE(data)
+            return True, []
+        except fastjsonschema.JsonSchemaException as e:
+            schema_error = e.message
+
+    errors = _check_fields(data)
+
+    #两套规则应保持一致（见test_validation.py）；万一不一致，至少返回schema的error
+    if not errors and schema_error is not None:
+        errors.append(schema_error)
+
+    #返回error list，里面包含所有需要修改的部分
+    return (len(errors) == 0), errors
+
+#逐项检查，和OUTPUT_SCHEMA是同一套规则，但会列出所有error
+def _check_fields(data: Any) -> List[str]:
+    errors: List[str] = []
+
+    #output是否是json
+    if not isinstance(data, dict):
+        return ["Output is not a JSON object."]
+
+    #Top-level的keys是否齐全
+    for key in ["contact", "call_note", "actions"]:
+        if key not in data:
+            errors.append(f"Missing top-level key: '{key}'")
+
+    contact = data.get("contact")
+    call_note = data.get("call_note")
+    actions = data.get("actions")
+
+    #contact schema
+    #是否是json
+    if not isinstance(contact, dict):
+        errors.append("Top-level 'contact' must be an object.")
+    else:
+        #哪怕是null也要包含所有字段
+        required_contact_keys = ["name", "email", "phone", "need", "budget", "timeline"]
+        for k in required_contact_keys:
+            if k not in contact:
+                errors.append(f"contact missing key: '{k}'")
+        #除budget外都是string或null
+        for k in _CONTACT_STR_KEYS:
+            v = contact.get(k)
+            if v is not None and not isinstance(v, str):
+                errors.append(f"contact.{k} must be string or null.")
+        #budget必须转化为number type或者null
+        b = contact.get("budget")
+        if b is not None and type(b) not in _NUM_TYPES:
+            errors.append("contact.budget must be a number or null (no $, commas, or abbreviations like '1.2M').")
+
+    #call_note schema
+    #必须是json
+    if not isinstance(call_note, dict):
+        errors.append("Top-level 'call_note' must be an object.")
+    else:
+        #必须有summary和rawTranscript
+        required_note_keys = ["summary", "rawTranscript"]
+        for k in required_note_keys:
+            if k not in call_note:
+                errors.append(f"call_note missing key: '{k}'")
+        #两者必须是string形式
+        s = call_note.get("summary")
+        rt = call_note.get("rawTranscript")
+        if s is not None and not isinstance(s, str):
+            errors.append("call_note.summary must be string or null.")
+        if rt is not None and not isinstance(rt, str):
+            errors.append("call_note.rawTranscript must be string or null.")
+
+    #actions schema
+    #actions必须为非空数组
+    if not isinstance(actions, list) or len(actions) == 0:
+        errors.append("'actions' must be a non-empty array.")
+    else:
+        #数量是1-3
+        if len(actions) > 3:
+            errors.append("actions must contain 1 to 3 items.")
+        #对于每个action
+        for i, act in enumerate(actions):
+            #必须是json
+            if not isinstance(act, dict):
+                errors.append(f"actions[{i}] must be an object.")
+                continue
+            
+            t = act.get("type")
+            payload = act.get("payload")
+            # type必须是在规定范围内的
+            if t not in ALLOWED_ACTION_TYPES:
+                errors.append(f"actions[{i}].type must be one of {_ALLOWED_ACTION_STR}")
+            #每条payload即使{}都不能是None或者非json形式
+            if payload is None or not isinstance(payload, dict):
+                errors.append(f"actions[{i}].payload must be an object ({{}} allowed).")
+                continue
+            #如果有create contact，那么payload必须为空，因为其信息储存在了top level里
+            if t == "create_contact":
+                if payload != {}:
+                    errors.append("create_contact.payload MUST be {} (facts must live in top-level contact).")
+            #如果有create call note，那么payload必须为空，因为其信息储存在了top level里
+            elif t == "create_call_note":
+                if payload != {}:
+                    errors.append("create_call_note.payload MUST be {} (facts must live in top-level call_note).")
+            #如果有create task，那么payload必须包含task type, description, due，类型也都必须是string
+            elif t == "create_task":
+                #直接按key取值，长度为3说明没有多余的key
+                match payload:
+                    case {"task_type": tt, "description": desc, "due": due} if len(payload) == 3:
+                        if not isinstance(tt, str) or tt not in ALLOWED_TASK_TYPES:
+                            errors.append(f"create_task.payload.task_type must be one of {_ALLOWED_TASK_STR}")
+                        if not isinstance(desc, str) or not desc.strip():
+                            errors.append("create_task.payload.description must be a non-empty string.")
+                        if due is not None and not isinstance(due, str):
+                            errors.append("create_task.payload.due must be string or null.")
+                    case _:
+                        errors.append(
+                            f"create_task.payload must have exactly keys {_TASK_PAYLOAD_KEYS_STR}, got {sorted(payload)}"
+                        )
+
+    return errors